@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Run iterations of the daemon loop (Agent.RunCycle) of a provisioned VM
+against the local fake wire server, and report requests per cycle, bytes
+transferred, CPU time and time to the first ReportReady.
+
+    python bench_agent.py [--cycles N] [--new-goal-state-every N] [--page-blob]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from env import waagent
+from fake_wire_server import FakeWireServer
+
+AgentConfText = """\
+Provisioning.Enabled=n
+Provisioning.MonitorHostName=n
+ResourceDisk.Format=n
+LBProbeResponder=y
+Logs.Verbose=n
+"""
+
+class AgentBenchmark(object):
+    """
+    Drive an Agent against a FakeWireServer from a temporary LibDir.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.libDir = None
+        self.cwd = None
+        self.saved = None
+        self.cycles = []
+        self.readyTime = None
+        self.cpuTime = 0
+        self.poolStats = None
+
+    def SetUp(self):
+        self.cwd = os.getcwd()
+        self.libDir = tempfile.mkdtemp()
+        os.chdir(self.libDir)
+        self.saved = (waagent.LibDir, waagent.Config, waagent.DiskActivated,
+                      waagent.GoalStateDocuments, waagent.provisioned,
+                      waagent.StatusBlobs, waagent.Handlers,
+                      waagent.HandlerStatuses, waagent.Bundles,
+                      waagent.EventAggregates, waagent.SystemInfo)
+        # MyDistro only exists once main() set it.
+        self.savedDistro = getattr(waagent, "MyDistro", None)
+        confFile = os.path.join(self.libDir, "waagent.conf")
+        waagent.SetFileContents(confFile, AgentConfText)
+        if self.savedDistro is None:
+            waagent.MyDistro = waagent.GetMyDistro()
+        waagent.LibDir = self.libDir
+        waagent.Config = waagent.ConfigurationProvider(confFile)
+        waagent.DiskActivated = True
+        waagent.GoalStateDocuments = waagent.GoalStateCache()
+        waagent.StatusBlobs = waagent.StatusBlobCache()
+        waagent.Handlers = waagent.HandlerRegistry()
+        waagent.HandlerStatuses = waagent.HandlerStatusCache()
+        waagent.Bundles = waagent.BundleCache()
+        waagent.EventAggregates = waagent.EventAggregator()
+        waagent.SystemInfo = waagent.SystemInfoProvider()
+        waagent.SetFileContents(os.path.join(self.libDir, "provisioned"), "")
+        waagent.HttpConnections.Clear()
+
+    def TearDown(self):
+        (waagent.LibDir, waagent.Config, waagent.DiskActivated,
+         waagent.GoalStateDocuments, waagent.provisioned,
+         waagent.StatusBlobs, waagent.Handlers,
+         waagent.HandlerStatuses, waagent.Bundles,
+         waagent.EventAggregates, waagent.SystemInfo) = self.saved
+        if self.savedDistro is None:
+            del waagent.MyDistro
+        waagent.HttpConnections.Clear()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.libDir, True)
+
+    def Run(self, cycles, newGoalStateEvery=0):
+        """
+        Run 'cycles' iterations; the server publishes a new incarnation
+        every 'newGoalStateEvery' iterations if set.
+        """
+        agent = waagent.Agent()
+        agent.Endpoint = self.server.endpoint
+        loop = waagent.EventLoop()
+        start = time.time()
+        cpuStart = os.times()
+        agent.CheckVersions()
+        agent.InitRunState()
+        for i in range(0, cycles):
+            if newGoalStateEvery and i > 0 and i % newGoalStateEvery == 0:
+                self.server.NewIncarnation()
+            requests = self.server.Count()
+            received, sent = self.server.Bytes()
+            agent.RunCycle(sleep=lambda seconds : None, loop=loop)
+            if i == 0:
+                # Send events synchronously so that they count in their cycle.
+                loop.Stop()
+                agent.EventsMonitor.timer.Cancel(True)
+            agent.EventsMonitor.EventsLoop()
+            totalReceived, totalSent = self.server.Bytes()
+            self.cycles.append((self.server.Count() - requests,
+                                totalReceived - received,
+                                totalSent - sent))
+        cpuEnd = os.times()
+        self.cpuTime = (cpuEnd[0] - cpuStart[0]) + (cpuEnd[1] - cpuStart[1])
+        if self.server.readyTime is not None:
+            self.readyTime = self.server.readyTime - start
+        self.poolStats = waagent.HttpConnections.GetStats()
+        agent.LoadBalancerProbeServer_Shutdown()
+        loop.Stop()
+
+    def Report(self):
+        print("cycles:              {0}".format(len(self.cycles)))
+        for i in range(0, len(self.cycles)):
+            print("cycle {0}: requests={1} bytesUp={2} bytesDown={3}".format(i, *self.cycles[i]))
+        requests = sum([c[0] for c in self.cycles])
+        print("requests per cycle:  {0:.2f}".format(float(requests) / max(len(self.cycles), 1)))
+        received, sent = self.server.Bytes()
+        print("bytes up/down:       {0}/{1}".format(received, sent))
+        print("cpu time:            {0:.3f}s".format(self.cpuTime))
+        if self.readyTime is not None:
+            print("time to ReportReady: {0:.3f}s".format(self.readyTime))
+        print("connection pool:     {0}".format(self.poolStats))
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--cycles", type="int", default=10)
+    parser.add_option("--new-goal-state-every", type="int", default=0,
+                      dest="newGoalStateEvery")
+    parser.add_option("--page-blob", action="store_true", default=False,
+                      dest="pageBlob")
+    options, args = parser.parse_args()
+    waagent.LoggerInit('/dev/null', '/dev/null')
+    server = FakeWireServer(blobType=options.pageBlob and "PageBlob" or "BlockBlob")
+    server.Start()
+    bench = AgentBenchmark(server)
+    bench.SetUp()
+    try:
+        bench.Run(options.cycles, options.newGoalStateEvery)
+    finally:
+        bench.TearDown()
+        server.Stop()
+    bench.Report()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
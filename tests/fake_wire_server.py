@@ -0,0 +1,304 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Local stand-in for the fabric endpoint (wire server) and the status blob
+store. It serves the documents the agent needs for a provisioned VM and
+records every request, so that tests and benchmarks can count the round
+trips and bytes of an agent cycle.
+"""
+
+import re
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+VersionsText = """\
+<?xml version="1.0" encoding="utf-8"?>
+<Versions>
+  <Preferred>
+    <Version>2012-11-30</Version>
+  </Preferred>
+  <Supported>
+    <Version>2012-11-30</Version>
+    <Version>2010-12-15</Version>
+  </Supported>
+</Versions>
+"""
+
+GoalStateFormat = """\
+<?xml version="1.0" encoding="utf-8"?>
+<GoalState>
+  <Version>2012-11-30</Version>
+  <Incarnation>{0}</Incarnation>
+  <Machine>
+    <ExpectedState>Started</ExpectedState>
+  </Machine>
+  <Container>
+    <ContainerId>c6d5526c-5ac2-4200-b6e2-56f2b70c5ab2</ContainerId>
+    <RoleInstanceList>
+      <RoleInstance>
+        <InstanceId>MachineRole_IN_0</InstanceId>
+        <State>Started</State>
+        <Configuration>
+          <HostingEnvironmentConfig>http://{1}/machine/?comp=config&amp;type=hostingEnvironmentConfig&amp;incarnation={0}</HostingEnvironmentConfig>
+          <SharedConfig>http://{1}/machine/?comp=config&amp;type=sharedConfig&amp;incarnation={0}</SharedConfig>
+          <ExtensionsConfig>http://{1}/machine/?comp=config&amp;type=extensionsConfig&amp;incarnation={0}</ExtensionsConfig>
+        </Configuration>
+      </RoleInstance>
+    </RoleInstanceList>
+  </Container>
+</GoalState>
+"""
+
+HostingEnvironmentConfigText = """\
+<?xml version="1.0" encoding="utf-8"?>
+<HostingEnvironmentConfig version="1.0.0.0" goalStateIncarnation="1">
+  <StoredCertificates />
+  <Deployment name="db00a7755a5e4e8a8fe4b19bc3b330c3" guid="{ce5a036f-5c93-40e7-8adf-2613631008ab}" incarnation="2">
+    <Service name="MyVMRoleService" guid="{00000000-0000-0000-0000-000000000000}" />
+    <ServiceInstance name="db00a7755a5e4e8a8fe4b19bc3b330c3.1" guid="{d113f4d7-9ead-4e73-b715-b724b5b7842c}" />
+  </Deployment>
+  <Incarnation number="1" instance="MachineRole_IN_0" guid="{a0faca35-52e5-4ec7-8fd1-63d2bc107d9b}" />
+  <Role guid="{73d95f1c-6472-e58e-7a1a-523554e11d46}" name="MachineRole" hostingEnvironmentVersion="1" software="" softwareType="ApplicationPackage" entryPoint="" parameters="" settleTimeSeconds="10" />
+  <ApplicationSettings>
+    <Setting name="__ModelData" value="&lt;m role=&quot;MachineRole&quot; xmlns=&quot;urn:azure:m:v1&quot;&gt;&lt;r name=&quot;MachineRole&quot;&gt;&lt;/r&gt;&lt;/m&gt;" />
+  </ApplicationSettings>
+  <ResourceReference>
+    <Resources>
+      <Resource name="DiagnosticStore" type="directory" request="Microsoft.Cis.Fabric.Controller.Descriptions.ServiceDescription.Data.Policy" sticky="true" size="1" path="db00a7755a5e4e8a8fe4b19bc3b330c3.MachineRole.DiagnosticStore\\" disableQuota="false" />
+    </Resources>
+  </ResourceReference>
+</HostingEnvironmentConfig>
+"""
+
+SharedConfigText = """\
+<?xml version="1.0" encoding="utf-8"?>
+<SharedConfig version="1.0.0.0" goalStateIncarnation="1">
+  <Deployment name="db00a7755a5e4e8a8fe4b19bc3b330c3" guid="{ce5a036f-5c93-40e7-8adf-2613631008ab}" incarnation="2">
+    <Service name="MyVMRoleService" guid="{00000000-0000-0000-0000-000000000000}" />
+    <ServiceInstance name="db00a7755a5e4e8a8fe4b19bc3b330c3.1" guid="{d113f4d7-9ead-4e73-b715-b724b5b7842c}" />
+  </Deployment>
+  <Incarnation number="1" instance="MachineRole_IN_0" guid="{a0faca35-52e5-4ec7-8fd1-63d2bc107d9b}" />
+  <Role guid="{73d95f1c-6472-e58e-7a1a-523554e11d46}" name="MachineRole" settleTimeSeconds="10" />
+  <Instances>
+    <Instance id="MachineRole_IN_0" address="10.115.153.75">
+      <FaultDomains randomId="0" updateId="0" updateCount="0" />
+      <InputEndpoints>
+        <Endpoint name="a" address="10.115.153.75:80" protocol="http" isPublic="true" enableDirectServerReturn="false" isDirectAddress="false" disableStealthMode="false">
+          <LocalPorts>
+            <LocalPortRange from="80" to="80" />
+          </LocalPorts>
+        </Endpoint>
+      </InputEndpoints>
+    </Instance>
+  </Instances>
+</SharedConfig>
+"""
+
+ExtensionsConfigFormat = """\
+<?xml version="1.0" encoding="utf-8"?>
+<Extensions version="1.0.0.0" goalStateIncarnation="{0}">
+  <StatusUploadBlob>http://{1}/blobs/status?sv=2014-02-14&amp;sr=b&amp;sig=fake</StatusUploadBlob>
+</Extensions>
+"""
+
+class FakeWireHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Dispatch a request to the FakeWireServer which owns the listener.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.wire.Handle(self)
+
+    def do_HEAD(self):
+        self.server.wire.Handle(self)
+
+    def do_POST(self):
+        self.server.wire.Handle(self)
+
+    def do_PUT(self):
+        self.server.wire.Handle(self)
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeWireServer(object):
+    """
+    Serve /?comp=versions, /machine/?comp=goalstate, the configuration
+    documents, health, roleProperties and telemetrydata, and a blob store
+    under /blobs/ for the status blob.
+    Every request is recorded as (method, path, comp, status, bytesIn, bytesOut).
+    """
+    def __init__(self, incarnation=1, blobType="BlockBlob"):
+        self.incarnation = incarnation
+        self.lock = threading.Lock()
+        self.requests = []
+        self.events = 0
+        self.readyTime = None
+        self.blobs = {"status" : {"type" : blobType, "data" : bytearray()}}
+        self.server = None
+        self.thread = None
+        self.endpoint = None
+
+    def Start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWireHandler)
+        self.server.wire = self
+        self.endpoint = "127.0.0.1:{0}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return self
+
+    def Stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def NewIncarnation(self):
+        self.lock.acquire()
+        self.incarnation += 1
+        self.lock.release()
+
+    def Count(self, method=None, comp=None):
+        self.lock.acquire()
+        try:
+            return len([r for r in self.requests
+                        if (method is None or r[0] == method) and
+                           (comp is None or r[2] == comp)])
+        finally:
+            self.lock.release()
+
+    def Bytes(self):
+        """
+        Return (bytes received, bytes sent) over all requests.
+        """
+        self.lock.acquire()
+        try:
+            return (sum([r[4] for r in self.requests]),
+                    sum([r[5] for r in self.requests]))
+        finally:
+            self.lock.release()
+
+    def Handle(self, handler):
+        url = urlparse.urlparse(handler.path)
+        query = urlparse.parse_qs(url.query)
+        comp = query.get("comp", [None])[0]
+        length = int(handler.headers.getheader("Content-Length", 0))
+        body = handler.rfile.read(length) if length > 0 else ""
+        status, headers, content = self.Route(handler, url.path, query, comp, body)
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+        if handler.command != "HEAD":
+            handler.wfile.write(content)
+        self.lock.acquire()
+        self.requests.append((handler.command, url.path, comp, status,
+                              len(body), len(content)))
+        self.lock.release()
+
+    def Route(self, handler, path, query, comp, body):
+        method = handler.command
+        if path.startswith("/blobs/"):
+            return self.HandleBlob(handler, path[len("/blobs/"):], comp, body)
+        if comp == "versions":
+            return 200, {}, VersionsText
+        if comp == "goalstate":
+            return 200, {}, GoalStateFormat.format(self.incarnation, self.endpoint)
+        if comp == "config":
+            docType = query.get("type", [None])[0]
+            if docType == "hostingEnvironmentConfig":
+                return 200, {}, HostingEnvironmentConfigText
+            if docType == "sharedConfig":
+                return 200, {}, SharedConfigText
+            if docType == "extensionsConfig":
+                return 200, {}, ExtensionsConfigFormat.format(self.incarnation, self.endpoint)
+        if method == "POST" and comp == "health":
+            if "<State>Ready</State>" in body and self.readyTime is None:
+                self.readyTime = time.time()
+            return 200, {"x-ms-latest-goal-state-incarnation-number" : str(self.incarnation)}, ""
+        if method == "POST" and comp == "roleProperties":
+            return 200, {}, ""
+        if method == "POST" and comp == "telemetrydata":
+            self.lock.acquire()
+            self.events += body.count("<Event ")
+            self.lock.release()
+            return 200, {}, ""
+        return 404, {}, ""
+
+    def HandleBlob(self, handler, name, comp, body):
+        method = handler.command
+        blob = self.blobs.get(name)
+        if method in ("GET", "HEAD"):
+            if blob is None:
+                return 404, {}, ""
+            return 200, {"x-ms-blob-type" : blob["type"]}, str(blob["data"])
+        if method != "PUT":
+            return 405, {}, ""
+        if comp == "page":
+            if blob is None:
+                return 404, {}, ""
+            match = re.match(r"bytes=(\d+)-(\d+)", handler.headers.getheader("x-ms-range", ""))
+            if match is None:
+                return 400, {}, ""
+            start, end = int(match.group(1)), int(match.group(2)) + 1
+            if end > len(blob["data"]):
+                return 416, {}, ""
+            if handler.headers.getheader("x-ms-page-write") == "clear":
+                blob["data"][start:end] = bytearray(end - start)
+            else:
+                blob["data"][start:end] = body
+            return 201, {}, ""
+        if comp == "properties":
+            if blob is None:
+                return 404, {}, ""
+            size = int(handler.headers.getheader("x-ms-blob-content-length", len(blob["data"])))
+            data = blob["data"][0:size]
+            blob["data"] = data + bytearray(size - len(data))
+            return 200, {}, ""
+        if comp == "block":
+            if blob is None:
+                return 404, {}, ""
+            blob.setdefault("blocks", {})[self.GetBlockId(handler)] = body
+            return 201, {}, ""
+        if comp == "blocklist":
+            if blob is None:
+                return 404, {}, ""
+            ids = re.findall(r"<(?:Latest|Uncommitted|Committed)>([^<]*)<", body)
+            blocks = blob.get("blocks", {})
+            blob["data"] = bytearray("".join([blocks.get(i, "") for i in ids]))
+            blob["blocks"] = {}
+            return 201, {}, ""
+        blobType = handler.headers.getheader("x-ms-blob-type", "BlockBlob")
+        if blobType == "PageBlob":
+            size = int(handler.headers.getheader("x-ms-blob-content-length", 0))
+            self.blobs[name] = {"type" : blobType, "data" : bytearray(size)}
+        else:
+            self.blobs[name] = {"type" : blobType, "data" : bytearray(body)}
+        return 201, {}, ""
+
+    def GetBlockId(self, handler):
+        query = urlparse.parse_qs(urlparse.urlparse(handler.path).query)
+        return query.get("blockid", [""])[0]
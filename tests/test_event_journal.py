@@ -0,0 +1,486 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+from env import waagent
+from tests.tools import *
+
+class TestEventJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = waagent.EventJournal(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+
+    def Segments(self):
+        return sorted([f for f in os.listdir(self.dir) if f.startswith("journal.")])
+
+    def test_append_read_ack(self):
+        self.journal.Append("one")
+        self.journal.Append("two")
+        records, cursor = self.journal.Read()
+        self.assertEquals(["one", "two"], records)
+        self.journal.Append("three")
+        self.journal.Ack(cursor)
+        records, cursor = self.journal.Read()
+        self.assertEquals(["three"], records)
+        self.journal.Ack(cursor)
+        self.assertEquals([], self.journal.Read()[0])
+        # Sent segments are deleted.
+        self.assertEquals([], self.Segments())
+
+    def test_cursor_persisted(self):
+        self.journal.Append("one")
+        self.journal.Append("two")
+        records, cursor = self.journal.Read()
+        self.journal.Ack({cursor.keys()[0] : 7})
+        self.journal.Close()
+        journal = waagent.EventJournal(self.dir)
+        self.assertEquals(["two"], journal.Read()[0])
+        journal.Append("three")
+        self.assertEquals(["two", "three"], journal.Read()[0])
+
+    def test_rotation(self):
+        @Mockup(waagent.EventJournal, "SegmentSize", 100)
+        def append():
+            for i in range(0, 30):
+                self.journal.Append("event {0:02d}".format(i))
+        append()
+        self.assertTrue(len(self.Segments()) > 2)
+        records, cursor = self.journal.Read()
+        self.assertEquals(["event {0:02d}".format(i) for i in range(0, 30)], records)
+        self.journal.Ack(cursor)
+        self.assertEquals([], self.Segments())
+
+    def test_rotations_before_ack(self):
+        @Mockup(waagent.EventJournal, "SegmentSize", 10)
+        def run():
+            self.journal.Append("old-0")
+            records, cursor = self.journal.Read()
+            self.assertEquals(["old-0"], records)
+            for i in range(0, 4):
+                self.journal.Append("new-{0}".format(i))
+            self.assertTrue(len(self.Segments()) > 2)
+            self.journal.Ack(cursor)
+            records, cursor = self.journal.Read()
+            self.assertEquals(["new-{0}".format(i) for i in range(0, 4)], records)
+            self.journal.Ack(cursor)
+            self.assertEquals([], self.journal.Read()[0])
+            self.assertEquals([], self.Segments())
+        run()
+
+    def test_two_writers(self):
+        other = waagent.EventJournal(self.dir)
+        self.journal.Append("e1")
+        other.Append("x1")
+        self.assertEquals(2, len(self.Segments()))
+        records, cursor = self.journal.Read()
+        self.assertEquals(["e1", "x1"], sorted(records))
+        other.Append("x2")
+        self.journal.Ack(cursor)
+        # The other process still appends to its segment.
+        self.assertEquals(1, len(self.Segments()))
+        records, cursor = self.journal.Read()
+        self.assertEquals(["x2"], records)
+        self.journal.Ack(cursor)
+        self.assertEquals([], self.journal.Read()[0])
+        self.journal.Append("e2")
+        other.Append("x3")
+        other.Close()
+        records, cursor = self.journal.Read()
+        self.assertEquals(["e2", "x3"], sorted(records))
+        self.journal.Ack(cursor)
+        self.assertEquals([], self.journal.Read()[0])
+        self.assertEquals([], self.Segments())
+
+    def test_trim(self):
+        @Mockup(waagent.EventJournal, "SegmentSize", 100)
+        @Mockup(waagent.EventJournal, "MaxSize", 300)
+        def append():
+            for i in range(0, 100):
+                self.journal.Append("event {0:02d}".format(i))
+        append()
+        records = self.journal.Read()[0]
+        self.assertTrue(len(records) < 50)
+        self.assertEquals("event 99", records[-1])
+
+    def test_truncated_record(self):
+        self.journal.Append("one")
+        self.journal.Append("two")
+        self.journal.Close()
+        path = os.path.join(self.dir, self.Segments()[0])
+        waagent.SetFileContents(path, waagent.GetFileContents(path, asbin=True)[:-1])
+        journal = waagent.EventJournal(self.dir)
+        journal.Append("three")
+        self.assertEquals(["one", "three"], journal.Read()[0])
+
+    def test_legacy_files(self):
+        waagent.SetFileContents(os.path.join(self.dir, "1.tld"), "old one")
+        waagent.SetFileContents(os.path.join(self.dir, "2.tld"), "old two")
+        waagent.SetFileContents(os.path.join(self.dir, "3.tmp"), "partial")
+        self.assertEquals(["old one", "old two"], self.journal.Read()[0])
+        self.assertEquals(["3.tmp"], [f for f in os.listdir(self.dir) if not f.startswith("journal.")])
+
+class FixedSystemInfo(object):
+    def Get(self):
+        return {"GAVersion" : "WALinuxAgent-test", "RoleName" : u"r\u00f4le", "RAM" : 1024}
+
+LegacyEvent = '<Data><Provider id="69B669B9-4AF8-4C50-BDC4-6006FA76E975"/><Event id="1"/><Param Name="Name" Value="A" T="mt:wstr" /><Param Name="RoleName" Value="" T="mt:wstr" /></Data>'
+
+class TestEncodeEvent(unittest.TestCase):
+
+    def test_encode(self):
+        event = waagent.ExtensionEvent()
+        event.Name = "A"
+        event.Message = "a <b> & ]]> \"c\" \xc3\xa9"
+        event.Duration = 3
+        event.OperationSuccess = False
+        wire = event.Encode(FixedSystemInfo().Get())
+        self.assertTrue(wire.startswith(u'<Event id="1"><![CDATA[<Param '))
+        self.assertTrue(wire.endswith(u' />]]></Event>'))
+        self.assertEquals(1, wire.count("]]>"))
+        self.assertTrue(u'<Param Name="Message" Value="a &lt;b&gt; &amp; ]]&gt; &quot;c&quot; \u00e9" T="mt:wstr" />' in wire)
+        self.assertTrue(u'<Param Name="Duration" Value="3" T="mt:uint64" />' in wire)
+        self.assertTrue(u'<Param Name="OperationSuccess" Value="False" T="mt:bool" />' in wire)
+        self.assertTrue(u'<Param Name="GAVersion" Value="WALinuxAgent-test" T="mt:wstr" />' in wire)
+        self.assertTrue(u'<Param Name="RoleName" Value="r\u00f4le" T="mt:wstr" />' in wire)
+        self.assertTrue(u'<Param Name="RAM" Value="1024" T="mt:uint64" />' in wire)
+        # The CDATA content parses as XML.
+        import xml.dom.minidom
+        cdata = wire[len(u'<Event id="1"><![CDATA['):-len(u']]></Event>')]
+        xml.dom.minidom.parseString((u"<Data>" + cdata + u"</Data>").encode("utf-8"))
+
+class FakeGoalState(object):
+    def __init__(self):
+        self.ContainerId = "c6d5526c-5ac2-4200-b6e2-56f2b70c5ab2"
+        self.HostingEnvironmentConfig = None
+        self.SharedConfig = None
+
+def ParseGoalState():
+    import fake_wire_server
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        goalState = FakeGoalState()
+        goalState.HostingEnvironmentConfig = waagent.HostingEnvironmentConfig().Parse(fake_wire_server.HostingEnvironmentConfigText)
+        goalState.SharedConfig = waagent.SharedConfig().Parse(fake_wire_server.SharedConfigText)
+    finally:
+        os.chdir(cwd)
+    return goalState
+
+class TestSystemInfoProvider(unittest.TestCase):
+
+    @Mockup(waagent, "MyDistro", waagent.GetMyDistro())
+    def test_static_info(self):
+        info = waagent.SystemInfoProvider().Get()
+        self.assertEquals(waagent.GuestAgentVersion, info["GAVersion"])
+        self.assertTrue(isinstance(info["Processors"], int) and info["Processors"] > 0)
+        self.assertTrue(info["RAM"] > 0)
+
+    @Mockup(waagent, "MyDistro", waagent.GetMyDistro())
+    def test_update(self):
+        provider = waagent.SystemInfoProvider()
+        before = provider.Get()
+        provider.Update(ParseGoalState())
+        info = provider.Get()
+        self.assertEquals("c6d5526c-5ac2-4200-b6e2-56f2b70c5ab2", info["ContainerId"])
+        self.assertEquals("db00a7755a5e4e8a8fe4b19bc3b330c3", info["TenantName"])
+        self.assertEquals("MachineRole", info["RoleName"])
+        self.assertEquals("MachineRole_IN_0", info["RoleInstanceName"])
+        self.assertEquals(before["GAVersion"], info["GAVersion"])
+        self.assertFalse("TenantName" in before)
+        wire = waagent.ExtensionEvent().Encode(info)
+        self.assertTrue(u'<Param Name="RoleInstanceName" Value="MachineRole_IN_0" T="mt:wstr" />' in wire)
+
+class TestCollectEvents(unittest.TestCase):
+
+    def test_collect(self):
+        libDir = tempfile.mkdtemp()
+        posts = []
+        @Mockup(waagent, "LibDir", libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "SystemInfo", FixedSystemInfo())
+        @Mockup(waagent, "TelemetryLimiter", waagent.TokenBucket(0, 1))
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator())
+        def collect():
+            monitor = waagent.WALAEventMonitor(lambda url, data : posts.append(data))
+            waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+            waagent.AddExtensionEvent("B", waagent.WALAEventOperation.Enable, False)
+            monitor.CollectAndSendWALAEvents()
+            monitor.CollectAndSendWALAEvents()
+        collect()
+        self.assertEquals(1, len(posts))
+        self.assertEquals(2, posts[0].count("<Event id="))
+        self.assertTrue('Value="WALinuxAgent-test"' in posts[0])
+        shutil.rmtree(libDir, True)
+
+    def test_failed_post(self):
+        libDir = tempfile.mkdtemp()
+        posts = []
+        def post(url, data):
+            if len(posts) == 1:
+                posts.append(None)
+                raise IOError("connection reset")
+            posts.append(data)
+        @Mockup(waagent, "LibDir", libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "SystemInfo", FixedSystemInfo())
+        @Mockup(waagent, "TelemetryLimiter", waagent.TokenBucket(0, 1))
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator())
+        @Mockup(waagent.WALAEventMonitor, "MaxPostSize", 2000)
+        def collect():
+            monitor = waagent.WALAEventMonitor(post)
+            for name in ("A", "B", "C"):
+                waagent.AddExtensionEvent(name, waagent.WALAEventOperation.Enable, True)
+            monitor.CollectAndSendWALAEvents()
+            monitor.CollectAndSendWALAEvents()
+            monitor.CollectAndSendWALAEvents()
+        collect()
+        # One event per post: A is sent, B fails, B and C are sent next time.
+        self.assertEquals(4, len(posts))
+        names = [p.split('<Param Name="Name" Value="')[1].split('"')[0] for p in posts if p is not None]
+        self.assertEquals(["A", "B", "C"], names)
+        shutil.rmtree(libDir, True)
+
+    def test_event_before_goal_state(self):
+        libDir = tempfile.mkdtemp()
+        posts = []
+        provider = waagent.SystemInfoProvider()
+        provider.info = {"GAVersion" : "WALinuxAgent-test"}
+        @Mockup(waagent, "LibDir", libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "SystemInfo", provider)
+        @Mockup(waagent, "TelemetryLimiter", waagent.TokenBucket(0, 1))
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator())
+        def collect():
+            waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+            provider.Update(ParseGoalState())
+            monitor = waagent.WALAEventMonitor(lambda url, data : posts.append(data))
+            monitor.CollectAndSendWALAEvents()
+        collect()
+        self.assertEquals(1, len(posts))
+        self.assertTrue('<Param Name="ContainerId" Value="c6d5526c-5ac2-4200-b6e2-56f2b70c5ab2" ' in posts[0])
+        self.assertTrue('<Param Name="TenantName" Value="db00a7755a5e4e8a8fe4b19bc3b330c3" ' in posts[0])
+        self.assertTrue('<Param Name="RoleName" Value="MachineRole" ' in posts[0])
+        self.assertTrue('<Param Name="RoleInstanceName" Value="MachineRole_IN_0" ' in posts[0])
+        shutil.rmtree(libDir, True)
+
+    def test_legacy_event(self):
+        libDir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(libDir, "events"))
+        waagent.SetFileContents(os.path.join(libDir, "events", "1.tld"), LegacyEvent)
+        posts = []
+        @Mockup(waagent, "LibDir", libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "SystemInfo", FixedSystemInfo())
+        @Mockup(waagent, "TelemetryLimiter", waagent.TokenBucket(0, 1))
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator())
+        def collect():
+            monitor = waagent.WALAEventMonitor(lambda url, data : posts.append(data))
+            monitor.CollectAndSendWALAEvents()
+        collect()
+        self.assertEquals(1, len(posts))
+        self.assertTrue(u'<Provider id="69B669B9-4AF8-4C50-BDC4-6006FA76E975"><Event id="1"><![CDATA[<Param Name="Name" T="mt:wstr" Value="A"/><Param Name="RoleName" T="mt:wstr" Value="r\u00f4le"/>]]></Event></Provider>' in posts[0])
+        shutil.rmtree(libDir, True)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def Sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = waagent.TokenBucket(0.5, 3, clock, clock.Sleep)
+        for i in range(0, 3):
+            self.assertEquals(0, bucket.Acquire())
+        self.assertEquals(2, bucket.Acquire())
+        self.assertEquals(2, bucket.Acquire())
+        clock.now += 60
+        for i in range(0, 3):
+            self.assertEquals(0, bucket.Acquire())
+        self.assertEquals(2, bucket.Acquire())
+
+    def test_unlimited(self):
+        clock = FakeClock()
+        bucket = waagent.TokenBucket(0, 1, clock, clock.Sleep)
+        for i in range(0, 10):
+            self.assertEquals(0, bucket.Acquire())
+        self.assertEquals([], clock.slept)
+
+class TestEventPriority(unittest.TestCase):
+
+    def setUp(self):
+        self.libDir = tempfile.mkdtemp()
+        self.posts = []
+
+    def tearDown(self):
+        shutil.rmtree(self.libDir, True)
+
+    def Collect(self, events, maxPostSize=63*1024):
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "SystemInfo", FixedSystemInfo())
+        @Mockup(waagent, "TelemetryLimiter", waagent.TokenBucket(0, 1))
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator())
+        @Mockup(waagent.WALAEventMonitor, "MaxPostSize", maxPostSize)
+        def collect():
+            for args in events:
+                waagent.AddExtensionEvent(*args)
+            monitor = waagent.WALAEventMonitor(lambda url, data : self.posts.append(data))
+            monitor.CollectAndSendWALAEvents()
+        collect()
+
+    def Names(self, post):
+        return [n.split('"')[0] for n in post.split('<Param Name="Name" Value="')[1:]]
+
+    def test_failures_first(self):
+        self.Collect([("A", waagent.WALAEventOperation.HeartBeat, True),
+                      ("B", waagent.WALAEventOperation.Enable, True),
+                      ("C", waagent.WALAEventOperation.Enable, False),
+                      ("WALA", waagent.WALAEventOperation.Provision, True)])
+        self.assertEquals(1, len(self.posts))
+        self.assertEquals(["C", "WALA", "A", "B"], self.Names(self.posts[0]))
+
+    def test_packing(self):
+        # 3 events of ~2100 bytes and 2 of ~1100 in posts of 3300: big
+        # events take a post each, small ones fill the room left.
+        self.Collect([("A", waagent.WALAEventOperation.Enable, False, 0, "1.0", "x" * 1000),
+                      ("B", waagent.WALAEventOperation.Enable, False, 0, "1.0", "x" * 1000),
+                      ("C", waagent.WALAEventOperation.Enable, False, 0, "1.0", "x" * 1000),
+                      ("D", waagent.WALAEventOperation.Enable, True),
+                      ("E", waagent.WALAEventOperation.Enable, True)], 3300)
+        self.assertEquals(3, len(self.posts))
+        self.assertEquals(["A", "D"], self.Names(self.posts[0]))
+        self.assertEquals(["B", "E"], self.Names(self.posts[1]))
+        self.assertEquals(["C"], self.Names(self.posts[2]))
+
+class TestEventAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.libDir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.libDir, True)
+
+    def Run(self, func):
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "SystemInfo", FixedSystemInfo())
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator(self.clock))
+        def run():
+            func()
+            return [r.decode("utf-8") for r in waagent.Events.Read()[0]]
+        return run()
+
+    def test_repeats_folded(self):
+        def add():
+            for duration in (4, 1, 2, 6):
+                waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True, duration, "1.0",
+                                          "ExitCode=0 UserTime={0}.000s".format(duration))
+                self.clock.now += 10
+            waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, False, 5)
+            waagent.AddExtensionEvent("B", waagent.WALAEventOperation.Enable, True, 5)
+            self.assertEquals(0, waagent.EventAggregates.Flush())
+            self.clock.now += 300
+            self.assertEquals(1, waagent.EventAggregates.Flush())
+        records = self.Run(add)
+        self.assertEquals(4, len(records))
+        summary = records[-1]
+        self.assertTrue('Name="Name" Value="A"' in summary)
+        self.assertTrue('Repeated 3 times from 1970-01-01T00:16:50Z to 1970-01-01T00:17:10Z, Duration min=1 avg=3 max=6' in summary)
+        self.assertTrue('<Param Name="Duration" Value="3" T="mt:uint64" />' in summary)
+
+    def test_usage_totals(self):
+        def add():
+            for userTime, maxRss in ((1.0, 100), (2.5, 300), (0.25, 200)):
+                usage = {"exitCode" : 0, "userTime" : userTime, "systemTime" : 0.5, "maxRss" : maxRss,
+                         "inBlock" : 8, "outBlock" : 16}
+                waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True, 1, "1.0",
+                                          waagent.FormatUsage(usage), usage=usage)
+            waagent.EventAggregates.Flush(force=True)
+        records = self.Run(add)
+        self.assertEquals(2, len(records))
+        # The first launch is sent on its own, the two others are summed up.
+        self.assertTrue('UserTime=1.000s' in records[0])
+        self.assertTrue('Repeated 2 times' in records[1])
+        self.assertTrue('total UserTime=2.750s SystemTime=1.000s InBlock=16 OutBlock=32, peak MaxRss=300KB' in records[1])
+
+    def test_new_window(self):
+        def add():
+            waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+            waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+            self.clock.now += 300
+            waagent.EventAggregates.Flush()
+            waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+            waagent.EventAggregates.Flush(force=True)
+        self.assertEquals(3, len(self.Run(add)))
+
+    def test_flush_on_exit(self):
+        def add():
+            for i in range(0, 3):
+                waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+            waagent.FlushEventAggregates()
+        records = self.Run(add)
+        self.assertEquals(2, len(records))
+        self.assertTrue('Repeated 2 times' in records[1])
+
+    def test_flush_on_sigterm(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                waagent.Events = waagent.EventJournal(self.libDir)
+                waagent.SystemInfo = FixedSystemInfo()
+                waagent.EventAggregates = waagent.EventAggregator(self.clock)
+                waagent.HandleShutdown()
+                for i in range(0, 3):
+                    waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+                os.kill(os.getpid(), signal.SIGTERM)
+                time.sleep(5)
+            finally:
+                os._exit(1)
+        status = os.waitpid(pid, 0)[1]
+        # The daemon still ends, after the summary is saved.
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEquals(0, os.WEXITSTATUS(status))
+        records = waagent.EventJournal(self.libDir).Read()[0]
+        self.assertEquals(2, len(records))
+        self.assertTrue('Repeated 2 times' in records[1])
+
+    def test_disabled(self):
+        @Mockup(waagent.EventAggregator, "Window", 0)
+        def add():
+            for i in range(0, 3):
+                waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True)
+        self.assertEquals(3, len(self.Run(add)))
+
+if __name__ == '__main__':
+    unittest.main()
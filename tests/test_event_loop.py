@@ -0,0 +1,95 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import socket
+import threading
+import time
+import unittest
+from env import waagent
+from tests.tools import *
+
+class MockDistro(object):
+    def GetIpv4Address(self):
+        return "127.0.0.1"
+
+def WaitFor(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+class TestEventLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = waagent.EventLoop()
+        self.loop.Start()
+
+    def tearDown(self):
+        self.loop.Stop()
+
+    def test_call_later(self):
+        fired = []
+        self.loop.CallLater(0.05, lambda : fired.append(1))
+        timer = self.loop.CallLater(0.05, lambda : fired.append(2))
+        timer.Cancel()
+        self.assertTrue(WaitFor(lambda : len(fired) > 0))
+        time.sleep(0.1)
+        self.assertEquals([1], fired)
+
+    def test_blocking_job_does_not_overlap(self):
+        state = {"running" : 0, "overlap" : False, "runs" : 0}
+        def job():
+            state["running"] += 1
+            if state["running"] > 1:
+                state["overlap"] = True
+            time.sleep(0.05)
+            state["runs"] += 1
+            state["running"] -= 1
+        timer = self.loop.CallEvery(0.01, job, blocking=True)
+        self.assertTrue(WaitFor(lambda : state["runs"] >= 3))
+        timer.Cancel(wait=True)
+        self.assertFalse(state["overlap"])
+
+    def test_blocking_job_does_not_block_timers(self):
+        release = threading.Event()
+        fired = []
+        self.loop.CallEvery(60, release.wait, blocking=True)
+        self.loop.CallLater(0.05, lambda : fired.append(1))
+        self.assertTrue(WaitFor(lambda : len(fired) > 0))
+        release.set()
+
+    @Mockup(waagent, "MyDistro", MockDistro())
+    def test_lb_probe(self):
+        server = waagent.LoadBalancerProbeServer(0, loop=self.loop)
+        port = server.server.getsockname()[1]
+        try:
+            for i in range(0, 3):
+                conn = socket.create_connection(("127.0.0.1", port), 5)
+                conn.sendall("GET / HTTP/1.1\r\n\r\n")
+                response = ""
+                while True:
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    response += data
+                conn.close()
+                self.assertTrue(response.startswith("HTTP/1.1 200 OK"))
+                self.assertTrue(response.endswith("\r\n\r\nOK"))
+            self.assertEquals(3, server.ProbeCounter)
+        finally:
+            server.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,401 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import subprocess
+import tempfile
+import stat
+import threading
+import time
+import unittest
+import zipfile
+from env import waagent
+from tests.tools import *
+
+PluginText = '<Plugin name="{0}" version="{1}" location="http://127.0.0.1/{0}_manifest.xml" config="" state="{2}" autoUpgrade="false" runAsStartupTask="false" isJson="true" />'
+
+SettingsText = '<Plugin name="{0}" version="{1}"><RuntimeSettings seqNo="{2}">{3}</RuntimeSettings></Plugin>'
+
+def ExtensionsConfigText(plugins, settings=[]):
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<Extensions version="1.0.0.0" goalStateIncarnation="1"><Plugins>' +
+            ''.join([PluginText.format(*p) for p in plugins]) +
+            '</Plugins><PluginSettings>' +
+            ''.join([SettingsText.format(*s) for s in settings]) +
+            '</PluginSettings></Extensions>')
+
+class RecordingProcessPlugin(object):
+    """
+    Stand-in for ExtensionsConfig.ProcessPlugin recording when each plugin
+    was processed, from which thread and with which Util.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def __call__(self, config, p, dom, incarnation, util):
+        start = time.time()
+        time.sleep(self.delay)
+        self.lock.acquire()
+        self.calls.append((p.getAttribute("name"), p.getAttribute("version"),
+                           start, time.time(), util))
+        self.lock.release()
+
+class TestConcurrentHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.libDir = tempfile.mkdtemp()
+        os.chdir(self.libDir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.libDir, True)
+
+    def Parse(self, plugins, delay=0.2):
+        process = RecordingProcessPlugin(delay)
+        def processPlugin(config, p, dom, incarnation, util):
+            process(config, p, dom, incarnation, util)
+        @Mockup(waagent.ExtensionsConfig, "ProcessPlugin", processPlugin)
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent, "Handlers", waagent.HandlerRegistry())
+        @Mockup(waagent, "ProcessedPlugins", {})
+        def parse():
+            waagent.ExtensionsConfig().Parse(ExtensionsConfigText(plugins))
+        parse()
+        return process.calls
+
+    def test_independent_handlers(self):
+        calls = self.Parse([("A", "1.0", "enabled"), ("B", "1.0", "enabled"),
+                            ("C", "1.0", "enabled")])
+        self.assertEquals(3, len(calls))
+        # All started before any finished.
+        self.assertTrue(max([c[2] for c in calls]) < min([c[3] for c in calls]))
+        # Each handler has its own Util.
+        self.assertEquals(3, len(set([id(c[4]) for c in calls])))
+
+    def test_same_handler_in_order(self):
+        calls = self.Parse([("A", "1.0", "uninstall"), ("B", "1.0", "enabled"),
+                            ("A", "1.1", "enabled")])
+        versions = [c[1] for c in calls if c[0] == "A"]
+        self.assertEquals(["1.0", "1.1"], versions)
+        first = [c for c in calls if c[0] == "A"]
+        self.assertTrue(first[0][3] <= first[1][2])
+
+    def test_max_parallel_handlers(self):
+        @Mockup(waagent.ExtensionsConfig, "MaxParallelHandlers", 1)
+        def parse():
+            return self.Parse([("A", "1.0", "enabled"), ("B", "1.0", "enabled")], 0.05)
+        calls = parse()
+        self.assertEquals(["A", "B"], [c[0] for c in calls])
+        self.assertTrue(calls[0][3] <= calls[1][2])
+
+class TestPluginDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.libDir = tempfile.mkdtemp()
+        os.chdir(self.libDir)
+        self.registry = waagent.HandlerRegistry(os.path.join(self.libDir, "HandlerRegistry.json"))
+        self.processed = {}
+        self.calls = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.libDir, True)
+
+    def Parse(self, plugins, settings=[]):
+        """
+        Parse with a ProcessPlugin putting the handler in the requested state.
+        """
+        registry = self.registry
+        def processPlugin(config, p, dom, incarnation, util):
+            name = p.getAttribute("name")
+            version = p.getAttribute("version")
+            self.calls.append(name + "-" + version)
+            registry.entries[name + "-" + version] = {"name" : name, "version" : version,
+                    "dir" : self.libDir, "manifest" : "[]", "seqNo" : None,
+                    "state" : p.getAttribute("state") == "enabled" and "Enabled" or "Disabled"}
+        @Mockup(waagent.ExtensionsConfig, "ProcessPlugin", processPlugin)
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent, "Handlers", registry)
+        @Mockup(waagent, "ProcessedPlugins", self.processed)
+        def parse():
+            return waagent.ExtensionsConfig().Parse(ExtensionsConfigText(plugins, settings))
+        self.calls = []
+        return parse()
+
+    def test_only_changes_processed(self):
+        plugins = [("A", "1.0", "enabled"), ("B", "1.0", "enabled")]
+        self.Parse(plugins, [("A", "1.0", 1, "a"), ("B", "1.0", 1, "b")])
+        self.assertEquals(["A-1.0", "B-1.0"], sorted(self.calls))
+
+        config = self.Parse(plugins, [("A", "1.0", 1, "a"), ("B", "1.0", 1, "b")])
+        self.assertEquals([], self.calls)
+        # Unchanged plugins still report their status.
+        self.assertEquals("[]", config.Plugins[0].getAttribute("manifestdata"))
+
+        self.Parse(plugins, [("A", "1.0", 1, "a"), ("B", "1.0", 2, "b")])
+        self.assertEquals(["B-1.0"], self.calls)
+        self.Parse(plugins, [("A", "1.0", 1, "a2"), ("B", "1.0", 2, "b")])
+        self.assertEquals(["A-1.0"], self.calls)
+        self.Parse([("A", "1.0", "disabled"), ("B", "1.0", "enabled")],
+                   [("A", "1.0", 1, "a2"), ("B", "1.0", 2, "b")])
+        self.assertEquals(["A-1.0"], self.calls)
+
+        self.Parse([("B", "1.0", "enabled")], [("B", "1.0", 2, "b")])
+        self.assertEquals([], self.calls)
+        self.assertEquals(["B-1.0"], self.processed.keys())
+
+    def test_not_in_requested_state(self):
+        plugins = [("A", "1.0", "enabled")]
+        self.Parse(plugins)
+        self.registry.entries["A-1.0"]["state"] = "Installed"   # enable failed
+        self.Parse(plugins)
+        self.assertEquals(["A-1.0"], self.calls)
+        del self.registry.entries["A-1.0"]
+        self.Parse(plugins)
+        self.assertEquals(["A-1.0"], self.calls)
+
+def IsRunning(pid):
+    try:
+        stat = open("/proc/{0}/stat".format(pid)).read()
+    except IOError:
+        return False
+    return stat.split(")")[-1].split()[0] != "Z"
+
+class TestWaitProcessGroup(unittest.TestCase):
+
+    def Start(self, cmd):
+        return subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, preexec_fn=os.setsid)
+
+    def test_exit_noticed(self):
+        start = time.time()
+        self.assertEquals(0, waagent.WaitProcessGroup(self.Start("true"), 10))
+        self.assertEquals(3, waagent.WaitProcessGroup(self.Start("exit 3"), 10))
+        self.assertTrue(time.time() - start < 2)
+
+    def test_usage(self):
+        usage = {}
+        code = waagent.WaitProcessGroup(self.Start("i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done; exit 3"), 30, usage=usage)
+        self.assertEquals(3, code)
+        self.assertEquals(3, usage["exitCode"])
+        self.assertTrue(usage["userTime"] + usage["systemTime"] > 0)
+        self.assertTrue(usage["maxRss"] > 0)
+        text = waagent.FormatUsage(usage)
+        self.assertTrue(text.startswith("ExitCode=3 UserTime="))
+        self.assertEquals("", waagent.FormatUsage({}))
+
+    def test_usage_signaled(self):
+        usage = {}
+        self.assertEquals(-9, waagent.WaitProcessGroup(self.Start("kill -9 $$"), 30, usage=usage))
+        self.assertEquals(-9, usage["exitCode"])
+
+    def test_timeout_kills_group(self):
+        pidFile = tempfile.mktemp()
+        child = self.Start("trap '' TERM; sleep 30 & echo $! > " + pidFile + "; wait")
+        start = time.time()
+        self.assertEquals(None, waagent.WaitProcessGroup(child, 0.5, 0.2))
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(IsRunning(child.pid))
+        self.assertFalse(IsRunning(int(open(pidFile).read())))
+        os.remove(pidFile)
+
+class TestBundleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = waagent.BundleCache(os.path.join(self.dir, "bundles"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+
+    def Download(self, name, data):
+        path = os.path.join(self.dir, name + ".zip")
+        waagent.SetFileContents(path, data)
+        return path
+
+    def Get(self, uri, cache=None):
+        dest = os.path.join(self.dir, "hit.zip")
+        if not (cache or self.cache).Get(uri, dest):
+            return None
+        return waagent.GetFileContents(dest)
+
+    def test_cached(self):
+        self.assertEquals(None, self.Get("http://host/a.zip"))
+        download = self.Download("a", "aaaa")
+        self.assertTrue(self.cache.Add("http://host/a.zip", download))
+        self.assertEquals("aaaa", waagent.GetFileContents(download))
+        self.assertEquals("aaaa", self.Get("http://host/a.zip"))
+        # Persisted
+        cache = waagent.BundleCache(self.cache.GetPath())
+        self.assertEquals("aaaa", self.Get("http://host/a.zip", cache))
+
+    def test_same_content(self):
+        self.cache.Add("http://host/a.zip", self.Download("a", "aaaa"))
+        self.cache.Add("http://mirror/a.zip", self.Download("b", "aaaa"))
+        self.assertEquals(2, len(os.listdir(self.cache.GetPath())))
+
+    def test_missing_file(self):
+        self.cache.Add("http://host/a.zip", self.Download("a", "aaaa"))
+        shutil.rmtree(self.cache.GetPath())
+        self.assertEquals(None, self.Get("http://host/a.zip"))
+
+    def test_corrupted_file(self):
+        self.cache.Add("http://host/a.zip", self.Download("a", "aaaa"))
+        path = [f for f in os.listdir(self.cache.GetPath()) if f.endswith(".zip")][0]
+        path = os.path.join(self.cache.GetPath(), path)
+        os.remove(path)
+        waagent.SetFileContents(path, "abcd")
+        self.assertEquals(None, self.Get("http://host/a.zip"))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "hit.zip")))
+        self.assertFalse(os.path.exists(path))
+
+    def test_evicted_while_used(self):
+        @Mockup(waagent.BundleCache, "MaxSize", 4)
+        def run():
+            self.cache.Add("http://host/a.zip", self.Download("a", "aaaa"))
+            self.assertEquals("aaaa", self.Get("http://host/a.zip"))
+            # Another handler caches its bundle, a is evicted.
+            self.cache.Add("http://host/b.zip", self.Download("b", "bbbb"))
+            self.assertEquals(None, self.cache.entries.get("http://host/a.zip"))
+        run()
+        self.assertEquals("aaaa", waagent.GetFileContents(os.path.join(self.dir, "hit.zip")))
+
+    def test_lru_eviction(self):
+        @Mockup(waagent.BundleCache, "MaxSize", 8)
+        def add():
+            self.cache.Add("http://host/a.zip", self.Download("a", "aaaa"))
+            time.sleep(0.01)
+            self.cache.Add("http://host/b.zip", self.Download("b", "bbbb"))
+            time.sleep(0.01)
+            self.Get("http://host/a.zip")
+            time.sleep(0.01)
+            self.cache.Add("http://host/c.zip", self.Download("c", "cccc"))
+        add()
+        self.assertEquals("aaaa", self.Get("http://host/a.zip"))
+        self.assertEquals(None, self.Get("http://host/b.zip"))
+        self.assertEquals(2, len([f for f in os.listdir(self.cache.GetPath()) if f.endswith(".zip")]))
+        self.assertEquals("cccc", self.Get("http://host/c.zip"))
+
+    def test_disabled(self):
+        @Mockup(waagent.BundleCache, "MaxSize", 0)
+        def add():
+            self.assertFalse(self.cache.Add("http://host/a.zip", self.Download("a", "aaaa")))
+            self.assertEquals(None, self.Get("http://host/a.zip"))
+        add()
+
+class TestExtractZip(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.zip = os.path.join(self.dir, "bundle.zip")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+
+    def Write(self, members):
+        z = zipfile.ZipFile(self.zip, "w")
+        for name, data, mode in members:
+            info = zipfile.ZipInfo(name)
+            if mode is not None:
+                info.create_system = 3
+                info.external_attr = mode << 16
+            else:
+                info.create_system = 0
+            z.writestr(info, data)
+        z.close()
+
+    def Mode(self, path):
+        return stat.S_IMODE(os.stat(os.path.join(self.dir, "out", path)).st_mode)
+
+    def test_extract(self):
+        self.Write([("bin/", "", 0755), ("bin/enable.sh", "x" * 1000, 0755),
+                    ("HandlerManifest.json", "[]", 0644), ("readme.txt", "r", None)])
+        self.assertEquals(3, waagent.ExtractZip(self.zip, os.path.join(self.dir, "out"), chunkSize=7))
+        self.assertEquals("x" * 1000, waagent.GetFileContents(os.path.join(self.dir, "out", "bin", "enable.sh")))
+        self.assertEquals(0755, self.Mode("bin/enable.sh"))
+        self.assertEquals(0744, self.Mode("HandlerManifest.json"))
+        self.assertEquals(0744, self.Mode("readme.txt"))
+
+    def test_path_traversal(self):
+        for name in ("../evil.sh", "/tmp/evil.sh", "bin/../../evil.sh"):
+            self.Write([("ok.sh", "ok", 0755), (name, "evil", 0755)])
+            self.assertEquals(None, waagent.ExtractZip(self.zip, os.path.join(self.dir, "out")))
+            self.assertFalse(os.path.exists(os.path.join(self.dir, "evil.sh")))
+
+    def test_bad_zip(self):
+        waagent.SetFileContents(self.zip, "not a zip")
+        self.assertEquals(None, waagent.ExtractZip(self.zip, os.path.join(self.dir, "out")))
+
+class TestOutputCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+
+    def test_chatty_child(self):
+        # More than a pipe buffer on both streams.
+        child = subprocess.Popen("head -c 200000 /dev/zero | tr '\\0' o; head -c 100000 /dev/zero | tr '\\0' e >&2; echo done >&2",
+                                 shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
+        stdout = waagent.OutputCapture(os.path.join(self.dir, "enableCommand.stdout")).Start(child.stdout)
+        stderr = waagent.OutputCapture(os.path.join(self.dir, "enableCommand.stderr")).Start(child.stderr)
+        self.assertEquals(0, waagent.WaitProcessGroup(child, 30))
+        stdout.Join(5)
+        stderr.Join(5)
+        self.assertEquals(200000, os.path.getsize(os.path.join(self.dir, "enableCommand.stdout")))
+        self.assertEquals("o" * 2048, stdout.GetTail())
+        self.assertTrue(stderr.GetTail().endswith("eeeedone\n"))
+        self.assertEquals(2048, len(stderr.GetTail()))
+
+    def test_rotation(self):
+        path = os.path.join(self.dir, "out")
+        @Mockup(waagent.OutputCapture, "MaxSize", 10000)
+        def capture(data):
+            r, w = os.pipe()
+            capture = waagent.OutputCapture(path).Start(os.fdopen(r, "rb"))
+            os.write(w, data)
+            os.close(w)
+            capture.Join(5)
+            return capture
+        capture("a" * 6000)
+        capture("b" * 6000)
+        self.assertEquals("a" * 6000, waagent.GetFileContents(path + ".1"))
+        self.assertEquals("b" * 6000, waagent.GetFileContents(path))
+        capture("c" * 6000)
+        self.assertEquals("b" * 6000, waagent.GetFileContents(path + ".1"))
+        self.assertFalse(os.path.exists(path + ".2"))
+
+class TestEventFiles(unittest.TestCase):
+
+    def test_concurrent_events(self):
+        libDir = tempfile.mkdtemp()
+        @Mockup(waagent, "LibDir", libDir)
+        @Mockup(waagent, "Events", waagent.EventJournal())
+        @Mockup(waagent, "EventAggregates", waagent.EventAggregator())
+        def save():
+            # Different messages, nothing is folded.
+            waagent.ParallelMap(lambda i : waagent.AddExtensionEvent("A", waagent.WALAEventOperation.Enable, True, 0, "1.0", "x" * i),
+                                range(0, 20), 4)
+            return waagent.Events.Read()[0]
+        self.assertEquals(20, len(save()))
+        shutil.rmtree(libDir, True)
+
+if __name__ == '__main__':
+    unittest.main()
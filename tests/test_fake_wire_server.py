@@ -0,0 +1,170 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from env import waagent
+from tests.tools import *
+from fake_wire_server import FakeWireServer
+from bench_agent import AgentBenchmark
+
+class TestAgentCycle(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeWireServer().Start()
+        self.bench = AgentBenchmark(self.server)
+        self.bench.SetUp()
+
+    def tearDown(self):
+        self.bench.TearDown()
+        self.server.Stop()
+
+    def test_steady_state(self):
+        self.bench.Run(3)
+        self.assertNotEquals(None, self.bench.readyTime)
+        self.assertEquals(1, self.server.Count("GET", "versions"))
+        self.assertEquals(1, self.server.Count("GET", "goalstate"))
+        self.assertEquals(3, self.server.Count("GET", "config"))
+        self.assertEquals(3, self.server.Count("POST", "health"))
+        self.assertEquals(1, self.server.events)
+        # Health report only, the blob type is cached and the status unchanged.
+        self.assertEquals(1, self.bench.cycles[2][0])
+        self.assertEquals(1, self.server.Count("HEAD"))
+        self.assertEquals(1, self.server.Count("PUT"))
+        self.assertTrue(self.server.blobs["status"]["data"].startswith('{"version":"1.0"'))
+
+    def test_new_goal_state(self):
+        # The agent learns about the new incarnation from the health
+        # report of cycle 2 and fetches it in cycle 3.
+        self.bench.Run(4, newGoalStateEvery=2)
+        self.assertEquals(1, self.bench.cycles[2][0])
+        self.assertEquals(2, self.server.Count("GET", "goalstate"))
+        self.assertEquals(6, self.server.Count("GET", "config"))
+
+    def test_status_max_staleness(self):
+        @Mockup(waagent.ExtensionsConfig, "StatusMaxStaleness", 0)
+        def run():
+            self.bench.Run(3)
+        run()
+        self.assertEquals(1, self.server.Count("HEAD"))
+        self.assertEquals(3, self.server.Count("PUT"))
+
+class TestBenchmarkState(unittest.TestCase):
+
+    def test_globals_restored(self):
+        server = FakeWireServer().Start()
+        try:
+            hadDistro = hasattr(waagent, "MyDistro")
+            systemInfo = waagent.SystemInfo
+            bench = AgentBenchmark(server)
+            bench.SetUp()
+            bench.Run(1)
+            bench.TearDown()
+        finally:
+            server.Stop()
+        self.assertEquals(hadDistro, hasattr(waagent, "MyDistro"))
+        self.assertTrue(waagent.SystemInfo is systemInfo)
+
+class TestPageBlob(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeWireServer(blobType="PageBlob").Start()
+        self.bench = AgentBenchmark(self.server)
+        self.bench.SetUp()
+        self.url = "http://{0}/blobs/status?sig=fake".format(self.server.endpoint)
+
+    def tearDown(self):
+        self.bench.TearDown()
+        self.server.Stop()
+
+    def Put(self, data):
+        self.server.requests = []
+        self.assertTrue(waagent.PutPageBlob(self.url, data))
+        self.assertEquals(data, str(self.server.blobs["status"]["data"]).rstrip("\0"))
+        return [(r[0], r[2], r[4]) for r in self.server.requests]
+
+    def test_delta(self):
+        data = "a" * 1500
+        self.assertEquals([("PUT", None, 0), ("PUT", "page", 1536)], self.Put(data))
+        self.assertEquals([], self.Put(data))
+        data = "a" * 600 + "b" + "a" * 899
+        self.assertEquals([("PUT", "page", 512)], self.Put(data))
+
+    def test_resize(self):
+        self.Put("a" * 600)
+        self.assertEquals([("PUT", "properties", 0), ("PUT", "page", 1024)],
+                          self.Put("a" * 1100))
+        self.assertEquals(1536, len(self.server.blobs["status"]["data"]))
+        self.assertEquals([("PUT", "page", 512), ("PUT", "page", 0)], self.Put("a" * 100))
+        self.assertEquals(1536, len(self.server.blobs["status"]["data"]))
+
+    def test_agent_cycle(self):
+        @Mockup(waagent.ExtensionsConfig, "StatusMaxStaleness", 0)
+        def run():
+            self.bench.Run(3)
+        run()
+        self.assertTrue(self.server.blobs["status"]["data"].startswith('{"version":"1.0"'))
+        # Create the blob once, then only write the page with the timestamp
+        # when it changed.
+        pages = self.server.Count("PUT", "page")
+        self.assertEquals(1, self.server.Count("PUT") - pages)
+        self.assertTrue(pages >= 1 and pages <= 3)
+        self.assertEquals(0, len([r for r in self.server.requests if r[0] == "PUT" and r[4] > 512]))
+
+class TestBlockBlob(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeWireServer().Start()
+        self.bench = AgentBenchmark(self.server)
+        self.bench.SetUp()
+        self.url = "http://{0}/blobs/status?sig=fake".format(self.server.endpoint)
+
+    def tearDown(self):
+        self.bench.TearDown()
+        self.server.Stop()
+
+    def test_single_put(self):
+        self.assertTrue(waagent.PutBlockBlob(self.url, "a" * 3500))
+        self.assertEquals(1, self.server.Count("PUT"))
+        self.assertEquals("a" * 3500, str(self.server.blobs["status"]["data"]))
+
+    def test_blocks(self):
+        data = "".join([chr(ord("a") + i % 26) for i in range(0, 3500)])
+        @Mockup(waagent, "StatusBlockThreshold", 1000)
+        @Mockup(waagent, "StatusBlockSize", 1000)
+        def put():
+            return waagent.PutBlockBlob(self.url, data)
+        self.assertTrue(put())
+        self.assertEquals(4, self.server.Count("PUT", "block"))
+        self.assertEquals(1, self.server.Count("PUT", "blocklist"))
+        self.assertEquals(data, str(self.server.blobs["status"]["data"]))
+
+class TestChangedPages(unittest.TestCase):
+
+    def test_ranges(self):
+        old = bytearray(512 * 6)
+        new = bytearray(old)
+        self.assertEquals([], waagent.GetChangedPages(old, new))
+        new[0] = 1
+        new[512 * 2] = 1
+        new[512 * 3 + 10] = 1
+        new[512 * 6 - 1] = 1
+        self.assertEquals([(0, 512), (1024, 2048), (2560, 3072)],
+                          waagent.GetChangedPages(old, new))
+        new = bytearray("x" * len(old))
+        self.assertEquals([(0, 1024), (1024, 2048), (2048, 3072)],
+                          waagent.GetChangedPages(old, new, maxRange=1024))
+
+if __name__ == '__main__':
+    unittest.main()
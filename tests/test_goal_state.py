@@ -0,0 +1,197 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from env import waagent
+from tests.tools import *
+
+GoalStateText = """\
+<GoalState>
+  <Version>2010-12-15</Version>
+  <Incarnation>1</Incarnation>
+  <Machine>
+    <ExpectedState>Started</ExpectedState>
+  </Machine>
+  <Container>
+    <ContainerId>c6d5526c</ContainerId>
+    <RoleInstanceList>
+      <RoleInstance>
+        <InstanceId>MachineRole_IN_0</InstanceId>
+        <Configuration>
+          <HostingEnvironmentConfig>http://h/?type=hostingEnvironmentConfig&amp;incarnation=1</HostingEnvironmentConfig>
+          <SharedConfig>http://h/?type=sharedConfig&amp;incarnation=1</SharedConfig>
+          <ExtensionsConfig>http://h/?type=extensionsConfig&amp;incarnation=1</ExtensionsConfig>
+        </Configuration>
+      </RoleInstance>
+    </RoleInstanceList>
+  </Container>
+</GoalState>
+"""
+
+HostingEnvironmentConfigText = """\
+<HostingEnvironmentConfig>
+  <Deployment name="db00a7755a5e4e8a8fe4b19bc3b330c3">
+    <Service name="MyVMRoleService" />
+    <ServiceInstance name="db00a7755a5e4e8a8fe4b19bc3b330c3.1" />
+  </Deployment>
+  <Incarnation number="1" instance="MachineRole_IN_0" />
+  <Role name="MachineRole" />
+</HostingEnvironmentConfig>
+"""
+
+SharedConfigText = """\
+<SharedConfig>
+  <Deployment name="db00a7755a5e4e8a8fe4b19bc3b330c3">
+    <Service name="MyVMRoleService" />
+    <ServiceInstance name="db00a7755a5e4e8a8fe4b19bc3b330c3.1" />
+  </Deployment>
+  <Incarnation number="1" instance="MachineRole_IN_0" />
+  <Role name="MachineRole" />
+  <Instances>
+    <Instance id="MachineRole_IN_0" address="10.115.153.75" />
+  </Instances>
+</SharedConfig>
+"""
+
+class MockAgent(object):
+    Endpoint = "h"
+    TransportCert = ""
+
+class MockGoalStateFetch(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.maxActive = 0
+
+    def __call__(self, url):
+        self.lock.acquire()
+        self.active += 1
+        self.maxActive = max(self.maxActive, self.active)
+        self.lock.release()
+        time.sleep(0.1)
+        self.lock.acquire()
+        self.active -= 1
+        self.lock.release()
+        if "hostingEnvironmentConfig" in url:
+            return HostingEnvironmentConfigText
+        if "sharedConfig" in url:
+            return SharedConfigText
+        return "<Extensions/>"
+
+class MockFetch(object):
+    def __init__(self, xmlText):
+        self.xmlText = xmlText
+        self.count = 0
+
+    def __call__(self, url):
+        self.count += 1
+        return self.xmlText
+
+class TestGoalStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "GoalStateCache.json")
+
+    def test_same_url_is_not_fetched(self):
+        cache = waagent.GoalStateCache(self.path)
+        fetch = MockFetch("<SharedConfig/>")
+        xmlText, changed = cache.Fetch("SharedConfig", "http://a/?incarnation=1", fetch)
+        self.assertEquals("<SharedConfig/>", xmlText)
+        self.assertTrue(changed)
+        xmlText, changed = cache.Fetch("SharedConfig", "http://a/?incarnation=1", fetch)
+        self.assertEquals("<SharedConfig/>", xmlText)
+        self.assertFalse(changed)
+        self.assertEquals(1, fetch.count)
+
+    def test_same_content_keeps_object(self):
+        cache = waagent.GoalStateCache(self.path)
+        fetch = MockFetch("<SharedConfig/>")
+        cache.Fetch("SharedConfig", "http://a/?incarnation=1", fetch)
+        obj = object()
+        cache.SetObject("SharedConfig", obj)
+        xmlText, changed = cache.Fetch("SharedConfig", "http://a/?incarnation=2", fetch)
+        self.assertFalse(changed)
+        self.assertEquals(2, fetch.count)
+        self.assertTrue(cache.GetObject("SharedConfig") is obj)
+
+        fetch.xmlText = "<SharedConfig></SharedConfig>"
+        xmlText, changed = cache.Fetch("SharedConfig", "http://a/?incarnation=3", fetch)
+        self.assertTrue(changed)
+        self.assertEquals(None, cache.GetObject("SharedConfig"))
+        self.assertEquals(2, cache.misses)
+        self.assertEquals(1, cache.hits)
+
+    def test_persisted(self):
+        cache = waagent.GoalStateCache(self.path)
+        fetch = MockFetch("<Certificates>\xe9</Certificates>")
+        cache.Fetch("Certificates", "http://a/?incarnation=1", fetch)
+
+        cache = waagent.GoalStateCache(self.path)
+        xmlText, changed = cache.Fetch("Certificates", "http://a/?incarnation=1", fetch)
+        self.assertEquals("<Certificates>\xe9</Certificates>", xmlText)
+        self.assertFalse(changed)
+        self.assertEquals(1, fetch.count)
+
+        xmlText, changed = cache.Fetch("Certificates", "http://a/?incarnation=1", fetch, reuse=False)
+        self.assertFalse(changed)
+        self.assertEquals(2, fetch.count)
+
+class TestParallelMap(unittest.TestCase):
+
+    def test_order(self):
+        results = waagent.ParallelMap(lambda x : x * 2, range(0, 10), 3)
+        self.assertEquals([x * 2 for x in range(0, 10)], results)
+        self.assertEquals([], waagent.ParallelMap(lambda x : x, [], 3))
+
+    def test_exception(self):
+        def func(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        self.assertRaises(ValueError, waagent.ParallelMap, func, range(0, 10), 3)
+
+class TestGoalState(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        self.cache = waagent.GoalStateCache(os.path.join(os.getcwd(), "cache.json"))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def test_parallel_fetch(self):
+        fetch = MockGoalStateFetch()
+        @Mockup(waagent, "GoalStateDocuments", self.cache)
+        @Mockup(waagent.GoalState, "HttpGetWithHeaders", lambda self, url : fetch(url))
+        def parse():
+            return waagent.GoalState(MockAgent()).Parse(GoalStateText)
+        goalState = parse()
+        self.assertNotEquals(None, goalState)
+        self.assertEquals(3, fetch.maxActive)
+        self.assertEquals("<Extensions/>", goalState.ExtensionsConfigXml)
+        self.assertNotEquals(None, goalState.HostingEnvironmentConfig)
+        self.assertNotEquals(None, goalState.SharedConfig)
+        self.assertTrue(goalState.SharedConfigChanged)
+
+        goalState = parse()
+        self.assertFalse(goalState.SharedConfigChanged)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import tempfile
+import threading
+import unittest
+from env import waagent
+from tests.tools import *
+
+StatusText = '[{"version":"1.0","timestampUTC":"2014-03-31T23:46:00Z","status":{"name":"ExampleHandlerLinux","operation":"Enable","status":"{0}"}}]'
+
+class CountingGetFileContents(object):
+    def __init__(self):
+        self.count = 0
+        self.origin = waagent.GetFileContents
+
+    def __call__(self, path, asbin=False):
+        self.count += 1
+        return self.origin(path, asbin)
+
+class TestHandlerStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.libDir = tempfile.mkdtemp()
+        self.handlerDir = os.path.join(self.libDir, "ExampleHandlerLinux-1.0")
+        os.makedirs(os.path.join(self.handlerDir, "config"))
+        os.makedirs(os.path.join(self.handlerDir, "status"))
+        waagent.SetFileContents(os.path.join(self.handlerDir, "config", "HandlerState"), "Enabled")
+        waagent.SetFileContents(os.path.join(self.handlerDir, "config", "1.settings"), "")
+        self.WriteStatus(1, "transitioning")
+
+    def WriteStatus(self, seqNo, status):
+        waagent.SetFileContents(os.path.join(self.handlerDir, "status", str(seqNo) + ".status"),
+                                StatusText.replace("{0}", status))
+
+    def test_cached(self):
+        cache = waagent.HandlerStatusCache()
+        reader = CountingGetFileContents()
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent, "HandlerStatuses", cache)
+        @Mockup(waagent, "GetFileContents", reader)
+        def generate():
+            return json.loads(waagent.ExtensionsConfig().GenerateAggStatus("ExampleHandlerLinux", "1.0"))
+        status = generate()
+        self.assertEquals("1", status["runtimeSettingsStatus"]["sequenceNumber"])
+        self.assertEquals("transitioning", status["runtimeSettingsStatus"]["settingsStatus"]["status"]["status"])
+        reads = reader.count
+        self.assertEquals(status, generate())
+        self.assertEquals(reads, reader.count)
+
+        self.WriteStatus(1, "success")
+        status = generate()
+        self.assertEquals("success", status["runtimeSettingsStatus"]["settingsStatus"]["status"]["status"])
+
+        waagent.SetFileContents(os.path.join(self.handlerDir, "config", "2.settings"), "")
+        cache.SettingsWritten(self.handlerDir, "2")
+        self.WriteStatus(2, "error")
+        status = generate()
+        self.assertEquals("2", status["runtimeSettingsStatus"]["sequenceNumber"])
+        self.assertEquals("error", status["runtimeSettingsStatus"]["settingsStatus"]["status"]["status"])
+
+    def test_sequence_number(self):
+        cache = waagent.HandlerStatusCache()
+        waagent.SetFileContents(os.path.join(self.handlerDir, "config", "7.settings"), "")
+        self.assertEquals("7", cache.GetSequenceNumber(self.handlerDir + "/"))
+        cache.SettingsWritten(self.handlerDir, "3")
+        self.assertEquals("7", cache.GetSequenceNumber(self.handlerDir))
+        cache.SettingsWritten(self.handlerDir + "/", "8")
+        self.assertEquals("8", cache.GetSequenceNumber(self.handlerDir))
+        cache.Forget(self.handlerDir)
+        self.assertEquals("7", cache.GetSequenceNumber(self.handlerDir))
+
+ManifestText = '[{"name":"ExampleHandlerLinux","version":1.0,"handlerManifest":{"installCommand":"install.sh","enableCommand":"enable.sh","reportHeartbeat":false}}]'
+
+class TestHandlerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.libDir = tempfile.mkdtemp()
+        handlerDir = os.path.join(self.libDir, "ExampleHandlerLinux-1.0", "bin")
+        os.makedirs(os.path.join(handlerDir, "config"))
+        waagent.SetFileContents(os.path.join(handlerDir, "HandlerManifest.json"), ManifestText)
+        waagent.SetFileContents(os.path.join(handlerDir, "config", "HandlerState"), "Enabled\n")
+        os.makedirs(os.path.join(self.libDir, "events"))
+        self.handlerDir = handlerDir
+
+    def test_existing_handlers(self):
+        @Mockup(waagent, "LibDir", self.libDir)
+        def load():
+            registry = waagent.HandlerRegistry()
+            return registry.Get("ExampleHandlerLinux", "1.0"), registry
+        entry, registry = load()
+        self.assertEquals(self.handlerDir, entry["dir"])
+        self.assertEquals("Enabled", entry["state"])
+        self.assertEquals("enable.sh", registry.GetManifest("ExampleHandlerLinux", "1.0")["handlerManifest"]["enableCommand"])
+        self.assertEquals("1.0", registry.GetLatestVersion("ExampleHandlerLinux"))
+        self.assertEquals(None, registry.GetLatestVersion("Other"))
+        self.assertTrue(os.path.isfile(os.path.join(self.libDir, "HandlerRegistry.json")))
+
+    def test_rebuild_not_seen_half_built(self):
+        registry = waagent.HandlerRegistry(os.path.join(self.libDir, "HandlerRegistry.json"))
+        readEntry = waagent.HandlerRegistry.ReadEntry
+        readers = []
+        seen = []
+        def slowReadEntry(self, name, version, zip_dir):
+            # Another handler looks itself up while the registry is rebuilt.
+            reader = threading.Thread(target=lambda : seen.append(registry.Get("ExampleHandlerLinux", "1.0")))
+            reader.start()
+            reader.join(0.2)
+            readers.append(reader)
+            return readEntry(self, name, version, zip_dir)
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent.HandlerRegistry, "ReadEntry", slowReadEntry)
+        def load():
+            registry.Load()
+        load()
+        for reader in readers:
+            reader.join()
+        self.assertEquals(1, len(seen))
+        self.assertEquals(self.handlerDir, seen[0]["dir"])
+
+    def test_persisted(self):
+        path = os.path.join(self.libDir, "HandlerRegistry.json")
+        registry = waagent.HandlerRegistry(path)
+        registry.entries = {}
+        registry.Register("ExampleHandlerLinux", "1.1", os.path.join(self.libDir, "ExampleHandlerLinux-1.0"))
+        registry.Update("ExampleHandlerLinux-1.1", "seqNo", "3")
+
+        registry = waagent.HandlerRegistry(path)
+        self.assertEquals("3", registry.Get("ExampleHandlerLinux", "1.1")["seqNo"])
+        self.assertEquals("1.1", registry.GetLatestVersion("ExampleHandlerLinux"))
+        registry.Remove("ExampleHandlerLinux", "1.1")
+        self.assertEquals(None, waagent.HandlerRegistry(path).Get("ExampleHandlerLinux", "1.1"))
+
+    def test_handler_state(self):
+        registry = waagent.HandlerRegistry(os.path.join(self.libDir, "HandlerRegistry.json"))
+        @Mockup(waagent, "LibDir", self.libDir)
+        @Mockup(waagent, "Handlers", registry)
+        def setState():
+            config = waagent.ExtensionsConfig()
+            config.SetHandlerState("ExampleHandlerLinux-1.0", "Disabled")
+            return config.GetHandlerState("ExampleHandlerLinux-1.0")
+        self.assertEquals("Disabled", setState())
+        self.assertEquals("Disabled", waagent.GetFileContents(os.path.join(self.handlerDir, "config", "HandlerState")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,11 @@
 
 import unittest
 from env import waagent
+import base64
+import hashlib
+import os
 import sys
+import tempfile
 from tests.tools import *
 
 class MockHTTPResponse(object):
@@ -54,6 +58,77 @@ class MockBadHTTPConnection(MockHTTPConnection):
     def getresponse(*args, **kwargs):
         return MockHTTPResponse(500)
 
+class MockNotFoundHTTPConnection(MockHTTPConnection):
+    def getresponse(*args, **kwargs):
+        return MockHTTPResponse(404)
+
+class MockKeepAliveHTTPConnection(MockHTTPConnection):
+    MockInstanceCount=0
+
+    def __init__(self, host, port):
+        super(MockKeepAliveHTTPConnection, self).__init__(host, port)
+        self.__class__.MockInstanceCount += 1
+
+MockBlob = "0123456789" * 1000
+
+class MockBlobHTTPResponse(object):
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.reason = "foo"
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self.body)
+        data = self.body[0:amt]
+        self.body = self.body[amt:]
+        return data
+
+class MockBlobHTTPConnection(MockHTTPConnection):
+    """
+    Serve MockBlob, honoring Range. The first response is cut in half.
+    """
+    MockRanges=[]
+
+    MockHeaders=[]
+
+    def request(self, method, url, data, headers = None):
+        self.headers = headers or {}
+        self.__class__.MockHeaders.append(self.headers)
+        self.__class__.MockCallCount += 1
+
+    def getresponse(self):
+        md5 = base64.b64encode(hashlib.md5(MockBlob).digest())
+        headers = {"x-ms-blob-content-md5" : md5, "ETag" : '"0x8D1"'}
+        start = 0
+        status = 200
+        if "Range" in self.headers:
+            start = int(self.headers["Range"][6:-1])
+            status = 206
+            headers["Content-Range"] = "bytes {0}-{1}/{2}".format(start, len(MockBlob) - 1, len(MockBlob))
+        self.__class__.MockRanges.append(start)
+        headers["Content-Length"] = str(len(MockBlob) - start)
+        body = MockBlob[start:]
+        if self.__class__.MockCallCount == 1:
+            body = body[0 : len(body) / 2]
+        return MockBlobHTTPResponse(status, headers, body)
+
+class MockFlakyBlobHTTPConnection(MockBlobHTTPConnection):
+    """
+    Cut the first response in half, then fail.
+    """
+    def getresponse(self):
+        if self.__class__.MockCallCount > 1:
+            return MockHTTPResponse(500)
+        return super(MockFlakyBlobHTTPConnection, self).getresponse()
+
 class MockHttpLib(object):
     def __init__(self):
         self.HTTPConnection = MockHTTPConnection
@@ -66,6 +141,9 @@ MockOSEnv = {
 
 class TestHttp(unittest.TestCase):
 
+    def setUp(self):
+        waagent.HttpConnections.Clear()
+
     def test_parseurl(self):
         httputil = waagent.Util()
         host, port, secure, path = httputil._ParseUrl("http://foo:8/bar?hehe")
@@ -143,5 +221,116 @@ class TestHttp(unittest.TestCase):
         httputil.HttpRequest("GET", "http://foo.bar", chkProxy=False, maxRetry=1)
         self.assertEquals(2, MockBadHTTPConnection.MockCallCount)
     
+    @Mockup(waagent.Util, "RetryWaitingInterval", 0)
+    @Mockup(waagent.httplib, "HTTPConnection", MockNotFoundHTTPConnection)
+    def test_no_retry_on_client_error(self):
+        httputil = waagent.Util()
+        MockNotFoundHTTPConnection.MockCallCount=0
+        print "The bellowing error log is expected:"
+        resp = httputil.HttpRequest("GET", "http://foo.bar", maxRetry=3)
+        self.assertEquals(None, resp)
+        self.assertEquals(1, MockNotFoundHTTPConnection.MockCallCount)
+
+    @Mockup(waagent.Util, "RetryJitter", False)
+    def test_retry_delay(self):
+        httputil = waagent.Util()
+        policy = httputil.GetRetryPolicy()
+        self.assertEquals(10, httputil.GetRetryDelay(0, policy))
+        self.assertEquals(20, httputil.GetRetryDelay(1, policy))
+        self.assertEquals(40, httputil.GetRetryDelay(2, policy))
+        self.assertEquals(60, httputil.GetRetryDelay(3, policy))
+
+        policy["jitter"] = True
+        for retry in range(0, 10):
+            delay = httputil.GetRetryDelay(retry, policy)
+            self.assertTrue(delay >= 0 and delay <= 60)
+
+    @Mockup(waagent.Util, "RetryWaitingInterval", 0)
+    @Mockup(waagent.httplib, "HTTPConnection", MockBadHTTPConnection)
+    def test_retry_budget(self):
+        httputil = waagent.Util()
+        MockBadHTTPConnection.MockCallCount=0
+        print "The bellowing error log is expected:"
+        httputil.HttpRequest("GET", "http://foo.bar", maxRetry=3, 
+                             retryBudget=-1)
+        self.assertEquals(1, MockBadHTTPConnection.MockCallCount)
+
+    @Mockup(waagent.Util, "RetryWaitingInterval", 0)
+    @Mockup(waagent.httplib, "HTTPConnection", MockBlobHTTPConnection)
+    def test_http_download_resume(self):
+        httputil = waagent.Util()
+        MockBlobHTTPConnection.MockCallCount=0
+        MockBlobHTTPConnection.MockRanges=[]
+        filepath = os.path.join(tempfile.mkdtemp(), "bundle.zip")
+        print "The bellowing warning log is expected:"
+        size = httputil.HttpDownload("http://foo.bar/bundle", filepath,
+                                     chunkSize=1000)
+        self.assertEquals(len(MockBlob), size)
+        self.assertEquals([0, len(MockBlob) / 2], MockBlobHTTPConnection.MockRanges)
+        self.assertEquals(MockBlob, waagent.GetFileContents(filepath))
+        self.assertFalse(os.path.exists(filepath + ".part"))
+
+    @Mockup(waagent.Util, "RetryWaitingInterval", 0)
+    @Mockup(waagent.httplib, "HTTPConnection", MockFlakyBlobHTTPConnection)
+    def test_http_download_retries(self):
+        httputil = waagent.Util()
+        MockFlakyBlobHTTPConnection.MockCallCount=0
+        MockFlakyBlobHTTPConnection.MockRanges=[]
+        filepath = os.path.join(tempfile.mkdtemp(), "bundle.zip")
+        print "The bellowing error log is expected:"
+        size = httputil.HttpDownload("http://foo.bar/bundle", filepath,
+                                     maxRetry=2, chunkSize=1000)
+        self.assertEquals(None, size)
+        # One request per attempt once the transfer started.
+        self.assertEquals(3, MockFlakyBlobHTTPConnection.MockCallCount)
+
+    @Mockup(waagent.Util, "RetryWaitingInterval", 0)
+    @Mockup(waagent.httplib, "HTTPConnection", MockBlobHTTPConnection)
+    def test_http_download_resume_later(self):
+        httputil = waagent.Util()
+        MockBlobHTTPConnection.MockCallCount=0
+        MockBlobHTTPConnection.MockRanges=[]
+        MockBlobHTTPConnection.MockHeaders=[]
+        filepath = os.path.join(tempfile.mkdtemp(), "bundle.zip")
+        print "The bellowing warning log is expected:"
+        self.assertEquals(None, httputil.HttpDownload("http://foo.bar/bundle", filepath,
+                                                      maxRetry=0, chunkSize=1000))
+        self.assertTrue(os.path.exists(filepath + ".part"))
+        size = httputil.HttpDownload("http://foo.bar/bundle", filepath, chunkSize=1000)
+        self.assertEquals(len(MockBlob), size)
+        self.assertEquals([0, len(MockBlob) / 2], MockBlobHTTPConnection.MockRanges)
+        self.assertEquals('"0x8D1"', MockBlobHTTPConnection.MockHeaders[1]["If-Range"])
+        self.assertEquals(MockBlob, waagent.GetFileContents(filepath))
+        self.assertEquals([], [f for f in os.listdir(os.path.dirname(filepath)) if f.startswith("bundle.zip.")])
+
+    @Mockup(waagent.Util, "RetryWaitingInterval", 0)
+    @Mockup(waagent.httplib, "HTTPConnection", MockBlobHTTPConnection)
+    def test_http_download_stale_part(self):
+        httputil = waagent.Util()
+        MockBlobHTTPConnection.MockCallCount=0
+        MockBlobHTTPConnection.MockRanges=[]
+        filepath = os.path.join(tempfile.mkdtemp(), "bundle.zip")
+        waagent.SetFileContents(filepath + ".part", "from another version")
+        print "The bellowing warning log is expected:"
+        size = httputil.HttpDownload("http://foo.bar/bundle", filepath, chunkSize=1000)
+        self.assertEquals(len(MockBlob), size)
+        # Started over: without an ETag the part can't be trusted.
+        self.assertEquals(0, MockBlobHTTPConnection.MockRanges[0])
+        self.assertEquals(MockBlob, waagent.GetFileContents(filepath))
+
+    @Mockup(waagent.httplib, "HTTPConnection", MockKeepAliveHTTPConnection)
+    def test_connection_pool(self):
+        httputil = waagent.Util()
+        MockKeepAliveHTTPConnection.MockInstanceCount=0
+        for i in range(0, 3):
+            resp = httputil.HttpRequest("GET", "http://foo.bar/get")
+            self.assertEquals("bar", resp.read())
+        self.assertEquals(1, MockKeepAliveHTTPConnection.MockInstanceCount)
+        httputil.HttpRequest("GET", "http://foo.bar:8080/get")
+        self.assertEquals(2, MockKeepAliveHTTPConnection.MockInstanceCount)
+        stats = waagent.HttpConnections.GetStats()
+        self.assertEquals(2, stats["hits"])
+        self.assertEquals(2, stats["misses"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import tempfile
+import unittest
+from env import waagent
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counters_and_histograms(self):
+        metrics = waagent.MetricsRegistry()
+        metrics.Increment("a")
+        metrics.Increment("a", 2)
+        metrics.SetGauge("g", 7)
+        metrics.Observe("latency", 0.02)
+        metrics.Observe("latency", 2)
+        snapshot = metrics.Snapshot()
+        self.assertEquals(3, snapshot["counters"]["a"])
+        self.assertEquals(7, snapshot["gauges"]["g"])
+        h = snapshot["histograms"]["latency"]
+        self.assertEquals(2, h["count"])
+        self.assertEquals(0.02, h["min"])
+        self.assertEquals(2, h["max"])
+        self.assertEquals(1, h["buckets"][1])
+        self.assertEquals(1, h["buckets"][5])
+        self.assertEquals(2, sum(h["buckets"]))
+
+    def test_save(self):
+        metrics = waagent.MetricsRegistry()
+        metrics.Increment("exec.forks")
+        path = os.path.join(tempfile.mkdtemp(), "metrics.json")
+        metrics.Save(path)
+        snapshot = json.loads(waagent.GetFileContents(path))
+        self.assertEquals(1, snapshot["counters"]["exec.forks"])
+        self.assertTrue("http.pool.hits" in snapshot["gauges"])
+        self.assertEquals(0, waagent.PrintStats(path))
+        self.assertEquals(1, waagent.PrintStats(path + ".missing"))
+
+    def test_metric_path(self):
+        self.assertEquals("/machine/?comp=health",
+                          waagent.GetMetricPath("/machine/?comp=health"))
+        self.assertEquals("/container/status.blob?comp=block",
+                          waagent.GetMetricPath("/container/status.blob?sv=2014&sig=secret&comp=block"))
+        self.assertEquals("/container/status.blob",
+                          waagent.GetMetricPath("/container/status.blob?sv=2014&sig=secret"))
+        self.assertEquals("/machine", waagent.GetMetricPath("/machine"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,14 +33,19 @@ def simple_file_grep(file_path, search_str):
 def Mockup(target, name, mock):
     def Decorator(func):
         def Wrapper(*args, **kwargs):
-            origin = getattr(target, name)
+            # Globals such as MyDistro only exist once main() set them.
+            exists = hasattr(target, name)
+            origin = getattr(target, name, None)
             setattr(target, name, mock)
             try:
                 result = func(*args, **kwargs)
             except:
                 raise
             finally:
-                setattr(target, name, origin)
+                if exists:
+                    setattr(target, name, origin)
+                else:
+                    delattr(target, name)
             return result
         return Wrapper
     return Decorator